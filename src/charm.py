@@ -4,13 +4,19 @@
 
 """Charmed operator for the 5G OMEC GNBSIM service."""
 
+import json
 import logging
+import os
+import re
+import time
 from ipaddress import IPv4Address
 from subprocess import check_output
-from typing import Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
+import yaml
 from charms.observability_libs.v1.kubernetes_service_patch import KubernetesServicePatch
-from lightkube.models.core_v1 import ServicePort
+from lightkube.models.core_v1 import ResourceRequirements, ServicePort
+from lightkube.utils.quantity import parse_quantity
 from ops.charm import (
     ActionEvent,
     CharmBase,
@@ -24,11 +30,37 @@ from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingSta
 from ops.pebble import ExecError
 
 from kubernetes import Kubernetes
+from performance import compare, measure
+from simulation import (
+    LOG_LEVELS,
+    enabled_profile_count,
+    enabled_ue_count,
+    gnbsim_command,
+    simulation_passed,
+    split_config,
+)
+from tracing import (
+    SPANS_FILE_NAME,
+    TracedContainer,
+    flush,
+    payload_size,
+    slowest_spans,
+    span,
+    traced,
+)
 
 logger = logging.getLogger(__name__)
 
 BASE_CONFIG_PATH = "/etc/gnbsim"
 CONFIG_FILE_NAME = "gnb.conf"
+DEFAULT_MEM_LIMIT = "1Gi"
+RUNS_DIRECTORY_NAME = "runs"
+METRICS_PATH = f"{BASE_CONFIG_PATH}/metrics"
+LOGS_PATH = f"{BASE_CONFIG_PATH}/logs"
+MAX_LOGGED_RUNS = 5
+MAX_RECORDED_RUNS = 50
+METRICS_FILE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._-]*$")
+RESOURCE_CONFIG_OPTIONS = ("cpu", "memory", "hugepages-2mi")
 
 
 class GNBSIMOperatorCharm(CharmBase):
@@ -37,12 +69,15 @@ class GNBSIMOperatorCharm(CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
         self._container_name = self._service_name = "gnbsim"
-        self._container = self.unit.get_container(self._container_name)
+        self._container = TracedContainer(self.unit.get_container(self._container_name))
         self._kubernetes = Kubernetes(namespace=self.model.name)
         self.framework.observe(self.on.install, self._on_install)
         self.framework.observe(self.on.config_changed, self._on_config_changed)
         self.framework.observe(self.on.gnbsim_pebble_ready, self._on_gnbsim_pebble_ready)
         self.framework.observe(self.on.start_simulation_action, self._on_start_simulation_action)
+        self.framework.observe(self.on.record_baseline_action, self._on_record_baseline_action)
+        self.framework.observe(self.on.get_log_files_action, self._on_get_log_files_action)
+        self.framework.observe(self.on.get_slowest_spans_action, self._on_get_slowest_spans_action)
         self.framework.observe(self.on.remove, self._on_remove)
         self._service_patcher = KubernetesServicePatch(
             charm=self,
@@ -51,20 +86,37 @@ class GNBSIMOperatorCharm(CharmBase):
                 ServicePort(name="http-api", port=6000),
             ],
         )
+        # Relies on the library internals: `_is_patched` is a private method of
+        # KubernetesServicePatch and may change when the library is updated.
+        self._service_patcher._is_patched = traced("k8s.service_patch.is_patched")(
+            self._service_patcher._is_patched
+        )
 
     def _on_config_changed(self, event: ConfigChangedEvent) -> None:
+        if invalid_config_message := self._invalid_config_message:
+            self.unit.status = BlockedStatus(invalid_config_message)
+            return
+        self._kubernetes.patch_statefulset(
+            statefulset_name=self.app.name,
+            resource_requirements=self._resource_requirements,
+        )
         if not self._container.can_connect():
             self.unit.status = WaitingStatus("Waiting for container to be ready")
             event.defer()
             return
         if self._use_default_config:
             self._write_default_config()
-            self._on_gnbsim_pebble_ready(event)
+        self._on_gnbsim_pebble_ready(event)
 
     def _on_install(self, event: InstallEvent) -> None:
         """Handle the install event."""
         self._kubernetes.create_network_attachment_definition()
-        self._kubernetes.patch_statefulset(statefulset_name=self.app.name)
+        if self._invalid_config_message:
+            return
+        self._kubernetes.patch_statefulset(
+            statefulset_name=self.app.name,
+            resource_requirements=self._resource_requirements,
+        )
 
     def _write_default_config(self) -> None:
         with open("src/files/default_config.yaml", "r") as f:
@@ -76,10 +128,72 @@ class GNBSIMOperatorCharm(CharmBase):
         """Handle the remove event."""
         self._kubernetes.delete_network_attachment_definition()
 
+    def _on_get_slowest_spans_action(self, event: ActionEvent) -> None:
+        spans = slowest_spans(
+            path=self._spans_file_path,
+            hooks=int(event.params["hooks"]),
+            limit=int(event.params["limit"]),
+        )
+        event.set_results({"spans": json.dumps(spans)})
+
+    @property
+    def _spans_file_path(self) -> str:
+        """Returns the path of the spans file in the charm directory."""
+        return str(self.charm_dir / SPANS_FILE_NAME)
+
     @property
     def _use_default_config(self) -> bool:
         return bool(self.model.config["use-default-config"])
 
+    @property
+    def _invalid_config_message(self) -> Optional[str]:
+        """Returns why the charm config is invalid, None if it is valid."""
+        if not self._resource_config_is_valid:
+            return "`cpu` and `memory` must be set together, and are required by `hugepages-2mi`"
+        for option in RESOURCE_CONFIG_OPTIONS:
+            if (value := self.model.config.get(option)) and not _is_quantity(value):
+                return f"`{option}` must be a Kubernetes quantity (e.g. `2`, `500m` or `1Gi`)"
+        if self.model.config["log-level"] not in LOG_LEVELS:
+            return f"`log-level` must be one of: {', '.join(LOG_LEVELS)}"
+        if int(self.model.config["simulation-processes"]) < 0:
+            return "`simulation-processes` must be 0 or more"
+        for option in ("log-max-file-size", "log-max-files"):
+            if int(self.model.config[option]) < 1:
+                return f"`{option}` must be 1 or more"
+        return None
+
+    @property
+    def _resource_config_is_valid(self) -> bool:
+        """Returns whether the cpu, memory and hugepages config options are consistent."""
+        cpu = self.model.config.get("cpu")
+        memory = self.model.config.get("memory")
+        if bool(cpu) != bool(memory):
+            return False
+        if self.model.config.get("hugepages-2mi") and not (cpu and memory):
+            return False
+        return True
+
+    @property
+    def _resource_requirements(self) -> Optional[ResourceRequirements]:
+        """Returns the gnbsim container resources, with requests equal to limits.
+
+        Returns:
+            ResourceRequirements: None if `cpu` and `memory` are not configured.
+        """
+        cpu = self.model.config.get("cpu")
+        memory = self.model.config.get("memory")
+        if not cpu or not memory:
+            return None
+        resources = {"cpu": cpu, "memory": memory}
+        if hugepages := self.model.config.get("hugepages-2mi"):
+            resources["hugepages-2Mi"] = hugepages
+        return ResourceRequirements(requests=dict(resources), limits=dict(resources))
+
+    @property
+    def _pod_name(self) -> str:
+        """Returns the name of the Kubernetes pod running this unit."""
+        return self.unit.name.replace("/", "-")
+
     @property
     def _config_file_is_written(self) -> bool:
         if not self._container.exists(f"{BASE_CONFIG_PATH}/{CONFIG_FILE_NAME}"):
@@ -90,11 +204,17 @@ class GNBSIMOperatorCharm(CharmBase):
 
     def _on_gnbsim_pebble_ready(self, event: Union[PebbleReadyEvent, ConfigChangedEvent]) -> None:
         """Handle the pebble ready event."""
+        if invalid_config_message := self._invalid_config_message:
+            self.unit.status = BlockedStatus(invalid_config_message)
+            return
         if not self._container.can_connect():
             self.unit.status = WaitingStatus("Waiting for container to be ready")
             event.defer()
             return
-        if not self._kubernetes.statefulset_is_patched(statefulset_name=self.app.name):
+        if not self._kubernetes.statefulset_is_patched(
+            statefulset_name=self.app.name,
+            resource_requirements=self._resource_requirements,
+        ):
             self.unit.status = WaitingStatus("Waiting for statefulset to be patched")
             event.defer()
             return
@@ -114,14 +234,19 @@ class GNBSIMOperatorCharm(CharmBase):
             self.unit.status = WaitingStatus("Waiting to be able to execute commands in container")
             event.defer()
             return
+        if self._resource_requirements and (
+            qos_class := self._kubernetes.get_pod_qos_class(pod_name=self._pod_name)
+        ):
+            self.unit.status = ActiveStatus(f"QoS class: {qos_class}")
+            return
         self.unit.status = ActiveStatus()
 
     def _execute_replace_ip_route(self) -> None:
-        process = self._container.exec(
-            command=["ip", "route", "replace", "192.168.252.3/32", "via", "192.168.251.1"],
-            timeout=30,
-        )
         try:
+            process = self._container.exec(
+                command=["ip", "route", "replace", "192.168.252.3/32", "via", "192.168.251.1"],
+                timeout=30,
+            )
             process.wait_output()
         except ExecError as e:
             logger.error("Exited with code %d. Stderr:", e.exit_code)
@@ -131,44 +256,282 @@ class GNBSIMOperatorCharm(CharmBase):
         logger.info("Replaced ip route")
 
     def _on_start_simulation_action(self, event: ActionEvent) -> None:
+        if invalid_config_message := self._invalid_config_message:
+            event.fail(f"Invalid config: {invalid_config_message}")
+            return
         if not self._container.can_connect():
             event.fail("Container is not ready")
             return
         if not self._config_file_is_written:
             event.fail("Config file is not written")
             return
+        baseline_name = event.params.get("baseline")
+        if baseline_name and not METRICS_FILE_NAME_PATTERN.match(baseline_name):
+            event.fail("Baseline name may only contain letters, digits, . _ and -")
+            return
+        if baseline_name:
+            baseline = self._read_metrics(f"{METRICS_PATH}/baselines/{baseline_name}.json")
+            if baseline is None:
+                event.fail(f"Baseline {baseline_name} is not recorded")
+                return
+        log_level = event.params.get("log-level") or self.model.config["log-level"]
+        if log_level not in LOG_LEVELS:
+            event.fail(f"Log level must be one of: {', '.join(LOG_LEVELS)}")
+            return
         self.unit.status = MaintenanceStatus("Starting simulation")
-        process = self._container.exec(
-            command=["/gnbsim/bin/gnbsim", "--cfg", f"{BASE_CONFIG_PATH}/{CONFIG_FILE_NAME}"],
-            timeout=300,
-            environment=self._environment_variables,
+        config = self._read_config()
+        config.setdefault("logger", {})["logLevel"] = log_level
+        run_directory = f"{BASE_CONFIG_PATH}/{RUNS_DIRECTORY_NAME}/{event.id}"
+        requested_processes = self._simulation_processes
+        config_paths = self._write_run_config_files(
+            config=config, run_directory=run_directory, processes=requested_processes
         )
-        try:
-            stdout, stderr = process.wait_output()
-        except ExecError as e:
-            logger.error("Exited with code %d. Stderr:", e.exit_code)
-            for line in e.stderr.splitlines():
-                logger.error("    %s", line)
-            raise e
-        if "Profile Status: PASS" in stderr:
-            event.set_results({"success": "true"})
-        else:
-            event.set_results({"success": "false"})
+        log_directory = f"{LOGS_PATH}/{event.id}"
+        self._container.make_dir(log_directory, make_parents=True)
+        start = time.monotonic()
+        runs = self._run_simulations(config_paths=config_paths, log_directory=log_directory)
+        run_duration = time.monotonic() - start
+        self._container.remove_path(run_directory, recursive=True)
+        self._remove_old_logs()
+        outputs = [output for _, output in runs]
+        passed_processes = len(
+            [output for exited, output in runs if exited and simulation_passed(output)]
+        )
+        metrics = measure(
+            outputs=outputs,
+            profile_count=enabled_profile_count(config),
+            ue_count=enabled_ue_count(config),
+            run_duration=run_duration,
+        )
+        self._record_run_metrics(run_id=event.id, metrics=metrics)
+        results = {
+            "success": str(passed_processes == len(outputs)).lower(),
+            "processes": str(len(outputs)),
+            "passed-processes": str(passed_processes),
+            "requested-processes": str(requested_processes),
+            "run-id": event.id,
+            "log-directory": log_directory,
+            "metrics": {metric: str(value) for metric, value in metrics.items()},
+        }
+        if len(outputs) < requested_processes:
+            results["warning"] = (
+                f"Ran {len(outputs)} of {requested_processes} requested gnbsim processes: "
+                "profiles sharing a gNB or overlapping IMSI ranges run in the same process"
+            )
+            logger.warning(results["warning"])
         self.unit.status = ActiveStatus("Successfully ran simulation")
+        if not baseline_name:
+            event.set_results(results)
+            return
+        verdicts = compare(
+            baseline=baseline,
+            metrics=metrics,
+            throughput_tolerance=float(event.params["throughput-tolerance"]),
+            latency_tolerance=float(event.params["latency-tolerance"]),
+        )
+        results["verdicts"] = verdicts
+        event.set_results(results)
+        regressed_metrics = [metric for metric, verdict in verdicts.items() if verdict == "fail"]
+        if regressed_metrics:
+            event.fail(
+                f"Performance regression against baseline {baseline_name}: "
+                f"{', '.join(regressed_metrics)}"
+            )
+
+    def _on_record_baseline_action(self, event: ActionEvent) -> None:
+        if not self._container.can_connect():
+            event.fail("Container is not ready")
+            return
+        name = event.params["name"]
+        run_id = event.params["run-id"]
+        if not METRICS_FILE_NAME_PATTERN.match(name) or not METRICS_FILE_NAME_PATTERN.match(
+            run_id
+        ):
+            event.fail("Baseline name and run id may only contain letters, digits, . _ and -")
+            return
+        metrics = self._read_metrics(f"{METRICS_PATH}/{RUNS_DIRECTORY_NAME}/{run_id}.json")
+        if metrics is None:
+            event.fail(f"No metrics recorded for run {run_id}")
+            return
+        self._write_metrics(path=f"{METRICS_PATH}/baselines/{name}.json", metrics=metrics)
+        event.set_results(
+            {
+                "baseline": name,
+                "metrics": {metric: str(value) for metric, value in metrics.items()},
+            }
+        )
+
+    def _on_get_log_files_action(self, event: ActionEvent) -> None:
+        if not self._container.can_connect():
+            event.fail("Container is not ready")
+            return
+        if not self._container.exists(LOGS_PATH):
+            event.set_results({"files": json.dumps([])})
+            return
+        log_directories = self._container.list_files(LOGS_PATH)
+        run_id = event.params.get("run-id")
+        files = []
+        for log_directory in sorted(log_directories, key=lambda file: file.last_modified):
+            if run_id and log_directory.name != run_id:
+                continue
+            files.extend(
+                file.path
+                for file in self._container.list_files(log_directory.path, pattern="*.log.*")
+            )
+        event.set_results({"files": json.dumps(files)})
+
+    def _remove_old_logs(self) -> None:
+        """Removes the log files of all but the most recent runs."""
+        log_directories = sorted(
+            self._container.list_files(LOGS_PATH), key=lambda file: file.last_modified
+        )
+        for log_directory in log_directories[:-MAX_LOGGED_RUNS]:
+            self._container.remove_path(log_directory.path, recursive=True)
+
+    def _read_config(self) -> dict:
+        """Returns the parsed gnbsim config file."""
+        return yaml.safe_load(self._container.pull(f"{BASE_CONFIG_PATH}/{CONFIG_FILE_NAME}"))
+
+    def _write_run_config_files(
+        self, config: dict, run_directory: str, processes: int
+    ) -> List[str]:
+        """Splits the gnbsim config into one run-scoped config file per process.
+
+        Args:
+            config: Parsed gnbsim config.
+            run_directory: Directory in the workload container for the run config files.
+            processes: Maximum number of gnbsim processes.
+
+        Returns:
+            list: Paths of the config files written in the workload container.
+        """
+        config_paths = []
+        for index, process_config in enumerate(split_config(config, processes=processes)):
+            path = f"{run_directory}/gnb-{index}.conf"
+            self._container.push(path=path, source=yaml.safe_dump(process_config), make_dirs=True)
+            config_paths.append(path)
+        logger.info(f"{len(config_paths)} run config files written in {run_directory}")
+        return config_paths
+
+    def _record_run_metrics(self, run_id: str, metrics: Dict[str, float]) -> None:
+        """Writes the metrics of a run and removes the oldest recorded runs.
+
+        Args:
+            run_id: Id of the start-simulation action.
+            metrics: Run metrics.
+        """
+        runs_directory = f"{METRICS_PATH}/{RUNS_DIRECTORY_NAME}"
+        self._write_metrics(path=f"{runs_directory}/{run_id}.json", metrics=metrics)
+        recorded_runs = sorted(
+            self._container.list_files(runs_directory, pattern="*.json"),
+            key=lambda file: file.last_modified,
+        )
+        for file in recorded_runs[:-MAX_RECORDED_RUNS]:
+            self._container.remove_path(file.path)
+
+    def _write_metrics(self, path: str, metrics: Dict[str, float]) -> None:
+        """Writes metrics as JSON in the workload container."""
+        self._container.push(path=path, source=json.dumps(metrics), make_dirs=True)
+        logger.info(f"Metrics written to {path}")
+
+    def _read_metrics(self, path: str) -> Optional[Dict[str, float]]:
+        """Returns metrics stored as JSON in the workload container, None if missing."""
+        if not self._container.exists(path):
+            return None
+        return json.load(self._container.pull(path))
+
+    def _run_simulations(
+        self, config_paths: List[str], log_directory: str
+    ) -> List[Tuple[bool, str]]:
+        """Starts one gnbsim process per config file and waits for all of them.
+
+        gnbsim output is written to rotated log files in `log_directory`, only the
+        profile summary lines are sent back to the charm.
+
+        Args:
+            config_paths: gnbsim config files in the workload container.
+            log_directory: Directory in the workload container for the log files.
+
+        Returns:
+            list: Whether each process exited successfully, and its profile summary lines.
+        """
+        environment = self._environment_variables
+        processes = []
+        for index, config_path in enumerate(config_paths):
+            processes.append(
+                self._container.exec(
+                    command=gnbsim_command(
+                        config_path=config_path,
+                        log_prefix=f"{log_directory}/gnbsim-{index}",
+                        max_file_size=int(self.model.config["log-max-file-size"]) * 1024 * 1024,
+                        max_files=int(self.model.config["log-max-files"]),
+                    ),
+                    timeout=300,
+                    environment=environment,
+                )
+            )
+        runs: List[Tuple[bool, str]] = []
+        for process in processes:
+            try:
+                _, stderr = process.wait_output()
+            except ExecError as e:
+                logger.error("Exited with code %d. Stderr:", e.exit_code)
+                for line in (e.stderr or "").splitlines():
+                    logger.error("    %s", line)
+                # Profiles may have reported their status before the process failed.
+                runs.append((False, e.stderr or ""))
+                continue
+            runs.append((True, stderr or ""))
+        return runs
+
+    @property
+    def _simulation_processes(self) -> int:
+        """Returns the number of gnbsim processes to run simulations with.
+
+        A `simulation-processes` value of 0 uses one process per CPU, taken from the
+        `cpu` config option when it is a whole number and from the host otherwise.
+        """
+        processes = int(self.model.config.get("simulation-processes", 1))
+        if processes > 0:
+            return processes
+        cpu = str(self.model.config.get("cpu") or "")
+        if cpu.isdigit() and int(cpu) > 0:
+            return int(cpu)
+        return os.cpu_count() or 1
 
     @property
     def _environment_variables(self) -> dict:
         """Returns the environment variables for the workload service."""
         return {
-            "MEM_LIMIT": "1Gi",
+            "MEM_LIMIT": self.model.config.get("memory") or DEFAULT_MEM_LIMIT,
             "POD_IP": str(self._pod_ip),
         }
 
     @property
     def _pod_ip(self) -> Optional[IPv4Address]:
         """Get the IP address of the Kubernetes pod."""
-        return IPv4Address(check_output(["unit-get", "private-address"]).decode().strip())
+        with span("subprocess", command="unit-get private-address") as record:
+            output = check_output(["unit-get", "private-address"])
+            record["response_bytes"] = payload_size(output)
+        return IPv4Address(output.decode().strip())
+
+
+def _is_quantity(value: str) -> bool:
+    """Returns whether a config value is a valid Kubernetes quantity."""
+    try:
+        parse_quantity(value)
+    except ValueError:
+        return False
+    return True
 
 
 if __name__ == "__main__":
-    main(GNBSIMOperatorCharm)
+    # Spans are written even when a handler raises, since failing hooks are often the
+    # slow ones and ops does not commit the framework in that case.
+    try:
+        main(GNBSIMOperatorCharm)
+    finally:
+        flush(
+            path=os.path.join(os.environ.get("JUJU_CHARM_DIR", "."), SPANS_FILE_NAME),
+            hook=os.environ.get("JUJU_DISPATCH_PATH", "unknown"),
+        )
@@ -5,19 +5,37 @@
 
 import json
 import logging
+from typing import List, Optional
 
 import httpx
 from lightkube import Client
 from lightkube.core.exceptions import ApiError
 from lightkube.generic_resource import create_namespaced_resource
-from lightkube.models.core_v1 import Capabilities
+from lightkube.models.core_v1 import (
+    Capabilities,
+    Container,
+    EmptyDirVolumeSource,
+    ResourceRequirements,
+    Volume,
+    VolumeMount,
+)
 from lightkube.models.meta_v1 import ObjectMeta
 from lightkube.resources.apps_v1 import StatefulSet
+from lightkube.resources.core_v1 import Pod
 from lightkube.types import PatchType
+from lightkube.utils.quantity import equals_canonically
+
+from tracing import TracedClient
 
 logger = logging.getLogger(__name__)
 
 NETWORK_ATTACHMENT_DEFINITION_NAME = "gnb-net"
+HUGEPAGES_VOLUME_NAME = "hugepages"
+HUGEPAGES_MOUNT_PATH = "/dev/hugepages"
+# Kubernetes only assigns the Guaranteed QoS class to a pod if all of its containers,
+# including the charm and init containers, have equal CPU and memory requests and limits.
+CHARM_CONTAINER_CPU = "250m"
+CHARM_CONTAINER_MEMORY = "256Mi"
 
 NetworkAttachmentDefinition = create_namespaced_resource(
     group="k8s.cni.cncf.io",
@@ -32,7 +50,7 @@ class Kubernetes:
 
     def __init__(self, namespace: str):
         """Initializes K8s client."""
-        self.client = Client()
+        self.client = TracedClient(Client())
         self.namespace = namespace
 
     def create_network_attachment_definition(self) -> None:
@@ -81,16 +99,30 @@ class Kubernetes:
             return False
         return False
 
-    def patch_statefulset(self, statefulset_name: str) -> None:
-        """Patches a statefulset with multus annotation.
+    def patch_statefulset(
+        self,
+        statefulset_name: str,
+        resource_requirements: Optional[ResourceRequirements] = None,
+    ) -> None:
+        """Patches a statefulset with multus annotation and container resources.
+
+        When `resource_requirements` is set, the charm and init containers also get equal
+        requests and limits so that the pod is in the Guaranteed QoS class. Resources and
+        the hugepages volume applied by a previous patch are removed when
+        `resource_requirements` is None or does not request hugepages. This works because
+        a merge patch replaces the `containers`, `initContainers` and `volumes` lists as a
+        whole.
 
         Args:
             statefulset_name: Statefulset name.
+            resource_requirements: Resources to apply to the gnbsim container.
 
         Returns:
             None
         """
-        if self.statefulset_is_patched(statefulset_name=statefulset_name):
+        if self.statefulset_is_patched(
+            statefulset_name=statefulset_name, resource_requirements=resource_requirements
+        ):
             return
         statefulset = self.client.get(
             res=StatefulSet, name=statefulset_name, namespace=self.namespace
@@ -115,6 +147,15 @@ class Kubernetes:
                 "NET_ADMIN",
             ]
         )
+        statefulset.spec.template.spec.containers[1].resources = resource_requirements
+        for container in _charm_containers(statefulset):
+            container.resources = (
+                _charm_container_resource_requirements() if resource_requirements else None
+            )
+        if resource_requirements and _requests_hugepages(resource_requirements):
+            self._add_hugepages_volume(statefulset=statefulset)
+        else:
+            self._remove_hugepages_volume(statefulset=statefulset)
 
         self.client.patch(
             res=StatefulSet,
@@ -125,11 +166,64 @@ class Kubernetes:
         )
         logger.info(f"Multus annotation added to {statefulset_name} Statefulset")
 
-    def statefulset_is_patched(self, statefulset_name: str) -> bool:
-        """Returns whether the statefulset has the expected multus annotation.
+    @staticmethod
+    def _add_hugepages_volume(statefulset: StatefulSet) -> None:
+        """Adds a HugePages backed volume to the statefulset and mounts it in gnbsim.
+
+        Args:
+            statefulset: Statefulset to modify.
+        """
+        pod_spec = statefulset.spec.template.spec
+        if not pod_spec.volumes:
+            pod_spec.volumes = []
+        if not any(volume.name == HUGEPAGES_VOLUME_NAME for volume in pod_spec.volumes):
+            pod_spec.volumes.append(
+                Volume(
+                    name=HUGEPAGES_VOLUME_NAME,
+                    emptyDir=EmptyDirVolumeSource(medium="HugePages"),
+                )
+            )
+        container = pod_spec.containers[1]
+        if not container.volumeMounts:
+            container.volumeMounts = []
+        if not any(mount.name == HUGEPAGES_VOLUME_NAME for mount in container.volumeMounts):
+            container.volumeMounts.append(
+                VolumeMount(name=HUGEPAGES_VOLUME_NAME, mountPath=HUGEPAGES_MOUNT_PATH)
+            )
+
+    @staticmethod
+    def _remove_hugepages_volume(statefulset: StatefulSet) -> None:
+        """Removes the HugePages backed volume and its gnbsim mount from the statefulset.
+
+        Args:
+            statefulset: Statefulset to modify.
+        """
+        pod_spec = statefulset.spec.template.spec
+        if pod_spec.volumes:
+            pod_spec.volumes = [
+                volume for volume in pod_spec.volumes if volume.name != HUGEPAGES_VOLUME_NAME
+            ]
+        container = pod_spec.containers[1]
+        if container.volumeMounts:
+            container.volumeMounts = [
+                mount for mount in container.volumeMounts if mount.name != HUGEPAGES_VOLUME_NAME
+            ]
+
+    def statefulset_is_patched(
+        self,
+        statefulset_name: str,
+        resource_requirements: Optional[ResourceRequirements] = None,
+    ) -> bool:
+        """Returns whether the statefulset has the expected multus annotation and resources.
+
+        Quantities are compared numerically since the API server rewrites them in their
+        canonical form (e.g. `0.5` CPU is returned as `500m`).
 
         Args:
             statefulset_name: Statefulset name.
+            resource_requirements: Resources expected on the gnbsim container, None if
+                the gnbsim container should not have any. The charm and init containers
+                are expected to have resources only when this is set.
 
         """
         statefulset = self.client.get(
@@ -142,8 +236,53 @@ class Kubernetes:
             logger.info("Multus annotation not yet added to statefulset")
             return False
 
+        resources = statefulset.spec.template.spec.containers[1].resources
+        if not equals_canonically(
+            resources or ResourceRequirements(),
+            resource_requirements or ResourceRequirements(),
+        ):
+            logger.info("Resources not yet applied to gnbsim container")
+            return False
+
+        expected_charm_resources = (
+            _charm_container_resource_requirements()
+            if resource_requirements
+            else ResourceRequirements()
+        )
+        for container in _charm_containers(statefulset):
+            if not equals_canonically(
+                container.resources or ResourceRequirements(), expected_charm_resources
+            ):
+                logger.info(f"Resources not yet applied to {container.name} container")
+                return False
+
+        hugepages_requested = bool(
+            resource_requirements and _requests_hugepages(resource_requirements)
+        )
+        hugepages_volume_mounted = any(
+            volume.name == HUGEPAGES_VOLUME_NAME
+            for volume in statefulset.spec.template.spec.volumes or []
+        )
+        if hugepages_requested != hugepages_volume_mounted:
+            logger.info("Hugepages volume not yet updated in statefulset")
+            return False
+
         return True
 
+    def get_pod_qos_class(self, pod_name: str) -> Optional[str]:
+        """Returns the QoS class Kubernetes assigned to a pod.
+
+        Args:
+            pod_name: Pod name.
+
+        Returns:
+            str: QoS class (Guaranteed, Burstable or BestEffort), None if not yet known.
+        """
+        pod = self.client.get(res=Pod, name=pod_name, namespace=self.namespace)
+        if not pod.status:
+            return None
+        return pod.status.qosClass
+
     def delete_network_attachment_definition(self) -> None:
         """Deletes network attachment definitions.
 
@@ -159,3 +298,22 @@ class Kubernetes:
             logger.info(
                 f"NetworkAttachmentDefinition {NETWORK_ATTACHMENT_DEFINITION_NAME} deleted"
             )
+
+
+def _requests_hugepages(resource_requirements: ResourceRequirements) -> bool:
+    """Returns whether resource requirements include hugepages."""
+    return any(
+        name.startswith("hugepages-") for name in (resource_requirements.limits or {}).keys()
+    )
+
+
+def _charm_containers(statefulset: StatefulSet) -> List[Container]:
+    """Returns the charm container and the init containers of a statefulset."""
+    pod_spec = statefulset.spec.template.spec
+    return [pod_spec.containers[0], *(pod_spec.initContainers or [])]
+
+
+def _charm_container_resource_requirements() -> ResourceRequirements:
+    """Returns the charm and init containers resources, with requests equal to limits."""
+    resources = {"cpu": CHARM_CONTAINER_CPU, "memory": CHARM_CONTAINER_MEMORY}
+    return ResourceRequirements(requests=dict(resources), limits=dict(resources))
@@ -0,0 +1,76 @@
+# Copyright 2022 Guillaume Belanger
+# See LICENSE file for licensing details.
+
+"""Simulation performance metrics and their comparison against a recorded baseline."""
+
+from typing import Dict, List
+
+from simulation import PROFILE_PASS_STATUS
+
+SUCCESS_RATE = "success-rate"
+RUN_DURATION = "run-duration"
+THROUGHPUT = "throughput"
+
+HIGHER_IS_BETTER_METRICS = (SUCCESS_RATE, THROUGHPUT)
+LOWER_IS_BETTER_METRICS = (RUN_DURATION,)
+
+
+def measure(
+    outputs: List[str], profile_count: int, ue_count: int, run_duration: float
+) -> Dict[str, float]:
+    """Returns the performance metrics of a simulation run.
+
+    The success rate is relative to the number of enabled profiles, so that profiles
+    of a process which failed before reporting their status count as failed.
+
+    Args:
+        outputs: stderr output of each gnbsim process.
+        profile_count: Number of enabled profiles.
+        ue_count: Number of UEs simulated by the enabled profiles.
+        run_duration: Wall time of the run in seconds.
+
+    Returns:
+        dict: Success rate of the profiles, run duration in seconds and throughput in
+            successfully simulated UEs per second.
+    """
+    passed_profiles = sum(output.count(PROFILE_PASS_STATUS) for output in outputs)
+    success_rate = min(passed_profiles, profile_count) / profile_count if profile_count else 0.0
+    throughput = ue_count * success_rate / run_duration if run_duration > 0 else 0.0
+    return {
+        SUCCESS_RATE: round(success_rate, 4),
+        RUN_DURATION: round(run_duration, 3),
+        THROUGHPUT: round(throughput, 4),
+    }
+
+
+def compare(
+    baseline: Dict[str, float],
+    metrics: Dict[str, float],
+    throughput_tolerance: float,
+    latency_tolerance: float,
+) -> Dict[str, str]:
+    """Compares run metrics against a baseline.
+
+    Success rate and throughput regress when they drop below the baseline by more than
+    `throughput_tolerance` percent. Run duration regresses when it rises above the
+    baseline by more than `latency_tolerance` percent.
+
+    Args:
+        baseline: Baseline metrics.
+        metrics: Metrics of the run to check.
+        throughput_tolerance: Allowed drop in percent.
+        latency_tolerance: Allowed rise in percent.
+
+    Returns:
+        dict: `pass` or `fail` verdict for each metric present in both.
+    """
+    verdicts = {}
+    for metric in HIGHER_IS_BETTER_METRICS:
+        if metric in baseline and metric in metrics:
+            threshold = baseline[metric] * (1 - throughput_tolerance / 100)
+            verdicts[metric] = "pass" if metrics[metric] >= threshold else "fail"
+    for metric in LOWER_IS_BETTER_METRICS:
+        if metric in baseline and metric in metrics:
+            threshold = baseline[metric] * (1 + latency_tolerance / 100)
+            verdicts[metric] = "pass" if metrics[metric] <= threshold else "fail"
+    return verdicts
@@ -0,0 +1,230 @@
+# Copyright 2022 Guillaume Belanger
+# See LICENSE file for licensing details.
+
+"""Utilities to split gnbsim configurations and run gnbsim processes."""
+
+import copy
+import logging
+import shlex
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PASS_STATUS = "Profile Status: PASS"
+GNBSIM_BINARY_PATH = "/gnbsim/bin/gnbsim"
+# gnbsim logs the profile summary lines at info level, stricter levels would hide them.
+LOG_LEVELS = ("trace", "debug", "info")
+SUMMARY_LINE_PATTERN = "Profile Status"
+
+GNBSIM_COMMAND_TEMPLATE = """\
+{{ {gnbsim} --cfg {config_path}; echo $? > {log_prefix}.status; }} 2>&1 \\
+    | awk -v summary={log_prefix}.summary -v pattern={summary_pattern} \\
+        'index($0, pattern) {{ print > summary; fflush(summary) }} {{ print }}' \\
+    | split -b {max_file_size} -a 3 - {log_prefix}.log. &
+rotate() {{
+    set -- {log_prefix}.log.???
+    while [ $# -gt 1 ]; do gzip -f "$1"; shift; done
+    set -- {log_prefix}.log.???.gz
+    while [ $# -gt "$keep" ]; do rm -f "$1"; shift; done
+}}
+keep={max_running_files}
+while kill -0 $! 2>/dev/null; do rotate; sleep 1; done
+set -- {log_prefix}.log.???
+[ -e "$1" ] && gzip -f "$@"
+keep={max_files}
+rotate
+[ -e {log_prefix}.summary ] && cat {log_prefix}.summary >&2
+status=$(cat {log_prefix}.status)
+rm -f {log_prefix}.status {log_prefix}.summary
+exit "$status"
+"""
+
+
+def _enabled_profiles(configuration: dict) -> List[Tuple[str, object, dict]]:
+    """Returns the enabled profiles and custom profiles of a gnbsim configuration.
+
+    Args:
+        configuration: The `configuration` section of a gnbsim config.
+
+    Returns:
+        list: (kind, key, profile) tuples where kind is `profiles` or `customProfiles`
+            and key is the list index or the dictionary key of the profile.
+    """
+    enabled = []
+    for index, profile in enumerate(configuration.get("profiles") or []):
+        if profile.get("enable"):
+            enabled.append(("profiles", index, profile))
+    for name, profile in (configuration.get("customProfiles") or {}).items():
+        if profile.get("enable"):
+            enabled.append(("customProfiles", name, profile))
+    return enabled
+
+
+def _imsi_ranges_overlap(first: dict, second: dict) -> bool:
+    """Returns whether the IMSI ranges of two profiles overlap.
+
+    Profiles without a `startImsi` are not considered overlapping.
+    """
+    if first.get("startImsi") is None or second.get("startImsi") is None:
+        return False
+    first_start = int(first["startImsi"])
+    second_start = int(second["startImsi"])
+    return first_start < second_start + int(
+        second.get("ueCount", 1)
+    ) and second_start < first_start + int(first.get("ueCount", 1))
+
+
+def _group_profiles(
+    enabled: List[Tuple[str, object, dict]],
+) -> List[List[Tuple[str, object, dict]]]:
+    """Groups the profiles which have to run in the same gnbsim process.
+
+    Profiles sharing a gNB share its N2/N3 sockets, and profiles with overlapping IMSI
+    ranges would register the same subscribers twice if they ran concurrently.
+
+    Args:
+        enabled: Enabled profiles as returned by `_enabled_profiles`.
+
+    Returns:
+        list: Groups of profiles, in the order of their first profile.
+    """
+    parents = list(range(len(enabled)))
+
+    def find(index: int) -> int:
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for first_index, (_, _, first) in enumerate(enabled):
+        for second_index in range(first_index + 1, len(enabled)):
+            second = enabled[second_index][2]
+            if first.get("gnbName") == second.get("gnbName") or _imsi_ranges_overlap(
+                first, second
+            ):
+                parents[find(second_index)] = find(first_index)
+
+    groups: Dict[int, List[Tuple[str, object, dict]]] = {}
+    for index, item in enumerate(enabled):
+        groups.setdefault(find(index), []).append(item)
+    return list(groups.values())
+
+
+def split_config(config: dict, processes: int) -> List[dict]:
+    """Splits the enabled profiles of a gnbsim config across several gnbsim configs.
+
+    Profiles sharing a gNB (and therefore its N2/N3 sockets) or overlapping IMSI
+    ranges are kept in the same config, and these groups are spread round-robin
+    across at most `processes` configs. Each config keeps the profiles in their
+    original order since gnbsim runs them in order. IMSIs are never changed, so fewer
+    configs than `processes` may be returned. The HTTP server and Go profiler are only
+    kept enabled in the first config since they listen on fixed ports. When the
+    profiles run in a single process, an unchanged copy of the config is returned.
+
+    Args:
+        config: Parsed gnbsim config.
+        processes: Maximum number of gnbsim processes.
+
+    Returns:
+        list: One gnbsim config per process.
+    """
+    configuration = config["configuration"]
+    enabled = _enabled_profiles(configuration)
+    groups = _group_profiles(enabled)
+    if min(processes, len(groups)) <= 1:
+        return [copy.deepcopy(config)]
+    buckets: List[List[Tuple[str, object, dict]]] = [
+        [] for _ in range(min(processes, len(groups)))
+    ]
+    for index, group in enumerate(groups):
+        buckets[index % len(buckets)].extend(group)
+    positions = {id(item): position for position, item in enumerate(enabled)}
+    for bucket in buckets:
+        bucket.sort(key=lambda item: positions[id(item)])
+
+    split_configs = []
+    for index, bucket in enumerate(buckets):
+        process_config = copy.deepcopy(config)
+        process_configuration = process_config["configuration"]
+        process_configuration["profiles"] = []
+        process_configuration["customProfiles"] = {}
+        for kind, key, profile in bucket:
+            if kind == "profiles":
+                process_configuration["profiles"].append(copy.deepcopy(profile))
+            else:
+                process_configuration["customProfiles"][key] = copy.deepcopy(profile)
+        gnb_names = {profile.get("gnbName") for _, _, profile in bucket}
+        process_configuration["gnbs"] = {
+            name: gnb
+            for name, gnb in (configuration.get("gnbs") or {}).items()
+            if name in gnb_names
+        }
+        if index > 0:
+            for server in ("httpServer", "goProfile"):
+                if server in process_configuration:
+                    process_configuration[server]["enable"] = False
+        split_configs.append(process_config)
+    return split_configs
+
+
+def gnbsim_command(
+    config_path: str, log_prefix: str, max_file_size: int, max_files: int
+) -> List[str]:
+    """Returns a command running gnbsim with its output written to rotated log files.
+
+    gnbsim output is split into files of at most `max_file_size` bytes named
+    `<log_prefix>.log.aaa`, `<log_prefix>.log.aab`, ... While gnbsim runs, finished
+    files are gzipped every second and the oldest ones removed, so that at most
+    `max_files` files (including the one being written) use the storage. The profile
+    summary lines are collected separately as they are logged, they are the only
+    output written back to stderr, and the command exits with the gnbsim exit code.
+
+    Args:
+        config_path: gnbsim config file in the workload container.
+        log_prefix: Path prefix of the log files in the workload container.
+        max_file_size: Maximum size of a log file in bytes.
+        max_files: Number of log files to keep.
+
+    Returns:
+        list: Command to execute in the workload container.
+    """
+    script = GNBSIM_COMMAND_TEMPLATE.format(
+        gnbsim=GNBSIM_BINARY_PATH,
+        config_path=shlex.quote(config_path),
+        log_prefix=shlex.quote(log_prefix),
+        max_file_size=max_file_size,
+        max_files=max_files,
+        max_running_files=max(max_files - 1, 0),
+        summary_pattern=shlex.quote(SUMMARY_LINE_PATTERN),
+    )
+    return ["sh", "-c", script]
+
+
+def enabled_profile_count(config: dict) -> int:
+    """Returns the number of enabled profiles and custom profiles of a gnbsim config.
+
+    Args:
+        config: Parsed gnbsim config.
+    """
+    return len(_enabled_profiles(config["configuration"]))
+
+
+def enabled_ue_count(config: dict) -> int:
+    """Returns the number of UEs simulated by the enabled profiles of a gnbsim config.
+
+    Args:
+        config: Parsed gnbsim config.
+    """
+    return sum(
+        int(profile.get("ueCount", 0))
+        for _, _, profile in _enabled_profiles(config["configuration"])
+    )
+
+
+def simulation_passed(output: str) -> bool:
+    """Returns whether a gnbsim run output reports a passing profile.
+
+    Args:
+        output: gnbsim stderr output.
+    """
+    return PROFILE_PASS_STATUS in output
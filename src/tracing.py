@@ -0,0 +1,272 @@
+# Copyright 2022 Guillaume Belanger
+# See LICENSE file for licensing details.
+
+"""Lightweight tracing of Kubernetes, Pebble and subprocess calls made during a hook."""
+
+import io
+import json
+import logging
+import os
+import shlex
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from typing import AnyStr, Callable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SPANS_FILE_NAME = "spans.jsonl"
+MAX_SPANS_FILE_SIZE = 1024 * 1024
+MAX_COMMAND_LENGTH = 120
+
+_spans: List[dict] = []
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    """Records a span around the wrapped block.
+
+    The yielded record can be updated by the caller, for example to add the size of a
+    response once it is known.
+
+    Args:
+        name: Span name, prefixed by the kind of call (`k8s`, `pebble` or `subprocess`).
+        attributes: Attributes stored with the span.
+
+    Yields:
+        dict: The span record.
+    """
+    record = {"name": name, **attributes}
+    start = time.monotonic()
+    record["start"] = time.time()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration_ms"] = round((time.monotonic() - start) * 1000, 3)
+        _spans.append(record)
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Returns a decorator recording a span for each call of the decorated function.
+
+    Args:
+        name: Span name.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracedClient:
+    """Proxy to a lightkube Client recording a span for each Kubernetes request."""
+
+    TRACED_METHODS = ("get", "list", "create", "patch", "replace", "apply", "delete")
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        """Returns the client attribute, wrapped in a span for request methods."""
+        attribute = getattr(self._client, name)
+        if name not in self.TRACED_METHODS:
+            return attribute
+
+        @wraps(attribute)
+        def traced_request(*args, **kwargs):
+            obj = kwargs.get("obj")
+            resource = kwargs.get("res") or (args[0] if args else type(obj))
+            with span(
+                f"k8s.{name}",
+                resource=getattr(resource, "__name__", str(resource)),
+                resource_name=kwargs.get("name"),
+                request_bytes=payload_size(obj),
+            ) as record:
+                response = attribute(*args, **kwargs)
+                if hasattr(response, "to_dict"):
+                    record["response_bytes"] = payload_size(response)
+            return response
+
+        return traced_request
+
+
+class TracedContainer:
+    """Proxy to an ops Container recording a span for each Pebble request."""
+
+    TRACED_METHODS = (
+        "can_connect",
+        "exists",
+        "list_files",
+        "make_dir",
+        "pull",
+        "push",
+        "remove_path",
+    )
+
+    def __init__(self, container):
+        self._container = container
+
+    def __getattr__(self, name: str):
+        """Returns the container attribute, wrapped in a span for Pebble requests."""
+        attribute = getattr(self._container, name)
+        if name == "exec":
+            return self._traced_exec(attribute)
+        if name not in self.TRACED_METHODS:
+            return attribute
+
+        @wraps(attribute)
+        def traced_request(*args, **kwargs):
+            attributes = {}
+            if path := kwargs.get("path", args[0] if args else None):
+                attributes["path"] = str(path)
+            source = kwargs.get("source", args[1] if len(args) > 1 else None)
+            if isinstance(source, (str, bytes)):
+                attributes["request_bytes"] = payload_size(source)
+            with span(f"pebble.{name}", **attributes) as record:
+                response = attribute(*args, **kwargs)
+                if name == "pull":
+                    # The pulled file is read here so that the span covers the transfer.
+                    content = response.read()
+                    record["response_bytes"] = payload_size(content)
+                    response = (
+                        io.StringIO(content) if isinstance(content, str) else io.BytesIO(content)
+                    )
+            return response
+
+        return traced_request
+
+    @staticmethod
+    def _traced_exec(exec_method: Callable) -> Callable:
+        """Returns `exec` wrapped in a span, with the returned process traced too."""
+
+        @wraps(exec_method)
+        def traced_exec(command: List[str], **kwargs):
+            command_line = shlex.join(command)[:MAX_COMMAND_LENGTH]
+            with span("pebble.exec", command=command_line):
+                process = exec_method(command=command, **kwargs)
+            return TracedExecProcess(process, command_line=command_line)
+
+        return traced_exec
+
+
+class TracedExecProcess:
+    """Proxy to an ops ExecProcess recording a span while waiting for it."""
+
+    def __init__(self, process, command_line: str):
+        self._process = process
+        self._command_line = command_line
+
+    def __getattr__(self, name: str):
+        """Returns the process attribute."""
+        return getattr(self._process, name)
+
+    def wait(self) -> None:
+        """Waits for the process to finish."""
+        with span("pebble.exec.wait", command=self._command_line):
+            self._process.wait()
+
+    def wait_output(self) -> Tuple[AnyStr, Optional[AnyStr]]:
+        """Waits for the process to finish and returns its stdout and stderr."""
+        with span("pebble.exec.wait", command=self._command_line) as record:
+            stdout, stderr = self._process.wait_output()
+            record["response_bytes"] = payload_size(stdout) + payload_size(stderr)
+        return stdout, stderr
+
+
+def payload_size(payload: object) -> int:
+    """Returns the size in bytes of a request or response payload.
+
+    Args:
+        payload: str, bytes or lightkube object.
+    """
+    if payload is None:
+        return 0
+    if isinstance(payload, str):
+        return len(payload.encode())
+    if isinstance(payload, bytes):
+        return len(payload)
+    if hasattr(payload, "to_dict"):
+        return len(json.dumps(payload.to_dict(), default=str))
+    return len(json.dumps(payload, default=str))
+
+
+def flush(path: str, hook: str) -> None:
+    """Appends the spans recorded so far to a JSON lines file.
+
+    Oldest spans are dropped so that the file stays below `MAX_SPANS_FILE_SIZE`. The file
+    is replaced atomically so that a hook killed while flushing does not truncate it.
+
+    Args:
+        path: Spans file path.
+        hook: Name of the hook or action the spans were recorded in.
+    """
+    if not _spans:
+        return
+    lines = []
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            lines = f.read().splitlines(keepends=True)
+    invocation = uuid.uuid4().hex[:8]
+    lines.extend(
+        json.dumps({"hook": hook, "invocation": invocation, **record}) + "\n" for record in _spans
+    )
+    size = sum(len(line) for line in lines)
+    first_kept_line = 0
+    while first_kept_line < len(lines) and size > MAX_SPANS_FILE_SIZE:
+        size -= len(lines[first_kept_line])
+        first_kept_line += 1
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(file_descriptor, "w") as f:
+            f.writelines(lines[first_kept_line:])
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    logger.info(f"{len(_spans)} spans written to {path}")
+    _spans.clear()
+
+
+def slowest_spans(path: str, hooks: int, limit: int) -> List[dict]:
+    """Returns the slowest spans recorded in the most recent hooks.
+
+    Lines which cannot be parsed are skipped.
+
+    Args:
+        path: Spans file path.
+        hooks: Number of most recent hooks to look at.
+        limit: Maximum number of spans to return.
+
+    Returns:
+        list: Spans sorted by decreasing duration.
+    """
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "invocation" in record and "duration_ms" in record:
+                records.append(record)
+    recent_invocations: List[str] = []
+    for record in reversed(records):
+        if record["invocation"] not in recent_invocations:
+            if len(recent_invocations) == hooks:
+                break
+            recent_invocations.append(record["invocation"])
+    recent_records = [record for record in records if record["invocation"] in recent_invocations]
+    return sorted(recent_records, key=lambda record: record["duration_ms"], reverse=True)[:limit]
@@ -1,22 +1,34 @@
 # Copyright 2022 Guillaume Belanger
 # See LICENSE file for licensing details.
 
+import io
+import json
 import unittest
 from unittest.mock import Mock, patch
 
+import yaml
+from lightkube.models.core_v1 import ResourceRequirements
 from ops import testing
-from ops.model import ActiveStatus
+from ops.model import ActiveStatus, BlockedStatus
+from ops.pebble import ExecError
 
+import tracing
 from charm import GNBSIMOperatorCharm
 
 
+def _exec_process(stdout: str = "", stderr: str = "") -> Mock:
+    """Returns a mock of a Pebble process exiting successfully."""
+    return Mock(wait_output=Mock(return_value=(stdout, stderr)))
+
+
 class TestCharm(unittest.TestCase):
     @patch("lightkube.core.client.GenericSyncClient")
     @patch(
         "charm.KubernetesServicePatch",
-        lambda charm, ports: None,
+        lambda charm, ports: Mock(),
     )
     def setUp(self, patch_k8s_client):
+        tracing._spans.clear()
         self.namespace = "whatever"
         self.harness = testing.Harness(GNBSIMOperatorCharm)
         self.harness.set_model_name(name=self.namespace)
@@ -64,6 +76,7 @@ class TestCharm(unittest.TestCase):
         patch_statefulset_is_patched.return_value = True
         patch_exists.return_value = True
         patch_check_output.return_value = pod_ip.encode()
+        patch_exec.return_value = _exec_process()
 
         self.harness.container_pebble_ready(container_name="gnbsim")
 
@@ -74,7 +87,7 @@ class TestCharm(unittest.TestCase):
 
     @patch("kubernetes.Kubernetes.statefulset_is_patched")
     @patch("charm.check_output")
-    @patch("ops.model.Container.exec", new=Mock())
+    @patch("ops.model.Container.exec", new=Mock(return_value=_exec_process()))
     @patch("ops.model.Container.exists")
     def test_given_config_file_is_written_when_pebble_ready_then_status_is_active(
         self, patch_exists, patch_check_output, patch_statefulset_is_patched
@@ -86,3 +99,393 @@ class TestCharm(unittest.TestCase):
         self.harness.container_pebble_ready("gnbsim")
 
         self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @patch("kubernetes.Kubernetes.patch_statefulset")
+    def test_given_cpu_memory_and_hugepages_when_config_changed_then_statefulset_is_patched_with_equal_requests_and_limits(  # noqa: E501
+        self, patch_patch_statefulset
+    ):
+        self.harness.update_config({"cpu": "2", "memory": "2Gi", "hugepages-2mi": "512Mi"})
+
+        expected_resources = {"cpu": "2", "memory": "2Gi", "hugepages-2Mi": "512Mi"}
+        patch_patch_statefulset.assert_called_with(
+            statefulset_name=self.harness.charm.app.name,
+            resource_requirements=ResourceRequirements(
+                requests=expected_resources, limits=expected_resources
+            ),
+        )
+
+    @patch("kubernetes.Kubernetes.patch_statefulset")
+    def test_given_cpu_without_memory_when_config_changed_then_status_is_blocked(
+        self, patch_patch_statefulset
+    ):
+        self.harness.update_config({"cpu": "2"})
+
+        patch_patch_statefulset.assert_not_called()
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus(
+                "`cpu` and `memory` must be set together, and are required by `hugepages-2mi`"
+            ),
+        )
+
+    @patch("kubernetes.Kubernetes.patch_statefulset")
+    def test_given_invalid_memory_quantity_when_config_changed_then_status_is_blocked(
+        self, patch_patch_statefulset
+    ):
+        self.harness.update_config({"cpu": "2", "memory": "2GB "})
+
+        patch_patch_statefulset.assert_not_called()
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("`memory` must be a Kubernetes quantity (e.g. `2`, `500m` or `1Gi`)"),
+        )
+
+    @patch("kubernetes.Kubernetes.get_pod_qos_class")
+    @patch("kubernetes.Kubernetes.patch_statefulset", new=Mock())
+    @patch("kubernetes.Kubernetes.statefulset_is_patched")
+    @patch("charm.check_output")
+    @patch("ops.model.Container.exec", new=Mock(return_value=_exec_process()))
+    @patch("ops.model.Container.exists")
+    def test_given_resources_configured_when_pebble_ready_then_qos_class_is_reported_in_status(
+        self,
+        patch_exists,
+        patch_check_output,
+        patch_statefulset_is_patched,
+        patch_get_pod_qos_class,
+    ):
+        patch_exists.return_value = True
+        patch_statefulset_is_patched.return_value = True
+        patch_check_output.return_value = b"1.2.3.4"
+        patch_get_pod_qos_class.return_value = "Guaranteed"
+        self.harness.update_config({"cpu": "2", "memory": "2Gi"})
+
+        self.harness.container_pebble_ready("gnbsim")
+
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus("QoS class: Guaranteed"))
+
+    @patch("kubernetes.Kubernetes.get_pod_qos_class")
+    @patch("kubernetes.Kubernetes.statefulset_is_patched")
+    @patch("charm.check_output")
+    @patch("ops.model.Container.exec", new=Mock(return_value=_exec_process()))
+    @patch("ops.model.Container.exists")
+    def test_given_resources_configured_and_qos_class_unknown_when_pebble_ready_then_status_is_active_without_qos_class(  # noqa: E501
+        self,
+        patch_exists,
+        patch_check_output,
+        patch_statefulset_is_patched,
+        patch_get_pod_qos_class,
+    ):
+        patch_exists.return_value = True
+        patch_statefulset_is_patched.return_value = True
+        patch_check_output.return_value = b"1.2.3.4"
+        patch_get_pod_qos_class.return_value = None
+        with patch("kubernetes.Kubernetes.patch_statefulset"):
+            self.harness.update_config({"cpu": "2", "memory": "2Gi"})
+
+        self.harness.container_pebble_ready("gnbsim")
+
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @patch("kubernetes.Kubernetes.patch_statefulset", new=Mock())
+    @patch("kubernetes.Kubernetes.statefulset_is_patched")
+    @patch("charm.check_output")
+    @patch("ops.model.Container.exec", new=Mock(return_value=_exec_process()))
+    @patch("ops.model.Container.exists")
+    def test_given_blocked_by_invalid_config_when_config_is_fixed_then_status_is_active(
+        self, patch_exists, patch_check_output, patch_statefulset_is_patched
+    ):
+        self.harness.set_can_connect(container="gnbsim", val=True)
+        patch_exists.return_value = True
+        patch_statefulset_is_patched.return_value = True
+        patch_check_output.return_value = b"1.2.3.4"
+        self.harness.update_config({"cpu": "2"})
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+        self.harness.update_config({"cpu": ""})
+
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @patch("charm.check_output")
+    @patch("ops.model.Container.list_files", new=Mock(return_value=[]))
+    @patch("ops.model.Container.remove_path")
+    @patch("ops.model.Container.push")
+    @patch("ops.model.Container.pull")
+    @patch("ops.model.Container.exec")
+    @patch("ops.model.Container.exists")
+    def test_given_two_simulation_processes_when_start_simulation_then_gnbsim_runs_once_per_run_config_file(  # noqa: E501
+        self,
+        patch_exists,
+        patch_exec,
+        patch_pull,
+        patch_push,
+        patch_remove_path,
+        patch_check_output,
+    ):
+        self.harness.set_can_connect(container="gnbsim", val=True)
+        patch_exists.return_value = True
+        patch_check_output.return_value = b"1.2.3.4"
+        patch_pull.return_value = io.StringIO(
+            yaml.safe_dump(
+                {
+                    "configuration": {
+                        "gnbs": {"gnb1": {}, "gnb2": {}},
+                        "profiles": [
+                            {"gnbName": "gnb1", "enable": True, "startImsi": 1, "ueCount": 5},
+                            {"gnbName": "gnb2", "enable": True, "startImsi": 100, "ueCount": 5},
+                        ],
+                    }
+                }
+            )
+        )
+        patch_exec.return_value.wait_output.side_effect = [
+            ("", "Profile Status: PASS"),
+            ("", "Profile Status: FAIL"),
+        ]
+        self.harness.update_config({"simulation-processes": 2})
+
+        output = self.harness.run_action("start-simulation")
+
+        pushed_paths = [push_call.kwargs["path"] for push_call in patch_push.call_args_list]
+        executed_scripts = [
+            exec_call.kwargs["command"][2] for exec_call in patch_exec.call_args_list
+        ]
+        self.assertEqual(len(executed_scripts), 2)
+        for config_path, script in zip(pushed_paths[:2], executed_scripts):
+            self.assertTrue(config_path.startswith("/etc/gnbsim/runs/"))
+            self.assertIn(f"--cfg {config_path}", script)
+        patch_remove_path.assert_called_once()
+        self.assertEqual(output.results["success"], "false")
+        self.assertEqual(output.results["processes"], "2")
+        self.assertEqual(output.results["passed-processes"], "1")
+
+    @patch("charm.check_output")
+    @patch("ops.model.Container.list_files", new=Mock(return_value=[]))
+    @patch("ops.model.Container.remove_path", new=Mock())
+    @patch("ops.model.Container.push", new=Mock())
+    @patch("ops.model.Container.pull")
+    @patch("ops.model.Container.exec")
+    @patch("ops.model.Container.exists")
+    def test_given_process_fails_when_start_simulation_then_its_output_is_kept_and_unreported_profiles_count_as_failed(  # noqa: E501
+        self, patch_exists, patch_exec, patch_pull, patch_check_output
+    ):
+        self.harness.set_can_connect(container="gnbsim", val=True)
+        patch_exists.return_value = True
+        patch_check_output.return_value = b"1.2.3.4"
+        patch_pull.return_value = io.StringIO(
+            yaml.safe_dump(
+                {
+                    "configuration": {
+                        "gnbs": {"gnb1": {}, "gnb2": {}},
+                        "profiles": [
+                            {"gnbName": "gnb1", "enable": True, "startImsi": 1, "ueCount": 5},
+                            {"gnbName": "gnb2", "enable": True, "startImsi": 100, "ueCount": 5},
+                            {"gnbName": "gnb2", "enable": True, "startImsi": 200, "ueCount": 5},
+                        ],
+                    }
+                }
+            )
+        )
+        patch_exec.return_value.wait_output.side_effect = [
+            ("", "Profile Status: PASS"),
+            ExecError(command=["sh"], exit_code=1, stdout="", stderr="Profile Status: PASS"),
+        ]
+        self.harness.update_config({"simulation-processes": 2})
+
+        output = self.harness.run_action("start-simulation")
+
+        self.assertEqual(output.results["success"], "false")
+        self.assertEqual(output.results["passed-processes"], "1")
+        self.assertEqual(output.results["metrics"]["success-rate"], "0.6667")
+
+    def _push_config_file(self, ue_count: int = 5) -> None:
+        self.harness.set_can_connect(container="gnbsim", val=True)
+        config = {
+            "configuration": {
+                "gnbs": {"gnb1": {}},
+                "profiles": [
+                    {"gnbName": "gnb1", "enable": True, "startImsi": 1, "ueCount": ue_count},
+                ],
+            }
+        }
+        self.harness.model.unit.get_container("gnbsim").push(
+            path="/etc/gnbsim/gnb.conf", source=yaml.safe_dump(config), make_dirs=True
+        )
+
+    @patch("charm.check_output")
+    @patch("ops.model.Container.exec")
+    def test_given_run_when_record_baseline_then_run_metrics_are_stored_as_baseline(
+        self, patch_exec, patch_check_output
+    ):
+        self._push_config_file()
+        patch_check_output.return_value = b"1.2.3.4"
+        patch_exec.return_value.wait_output.return_value = ("", "Profile Status: PASS")
+        run = self.harness.run_action("start-simulation")
+
+        output = self.harness.run_action(
+            "record-baseline", {"name": "release-1", "run-id": run.results["run-id"]}
+        )
+
+        container = self.harness.model.unit.get_container("gnbsim")
+        baseline = json.loads(
+            container.pull("/etc/gnbsim/metrics/baselines/release-1.json").read()
+        )
+        self.assertEqual(baseline["success-rate"], 1.0)
+        self.assertEqual(output.results["metrics"]["success-rate"], "1.0")
+
+    def test_given_unknown_run_when_record_baseline_then_action_fails(self):
+        self.harness.set_can_connect(container="gnbsim", val=True)
+
+        with self.assertRaises(testing.ActionFailed):
+            self.harness.run_action("record-baseline", {"name": "release-1", "run-id": "42"})
+
+    @patch("charm.check_output")
+    @patch("ops.model.Container.exec")
+    def test_given_success_rate_below_baseline_when_start_simulation_then_action_fails_with_verdicts(  # noqa: E501
+        self, patch_exec, patch_check_output
+    ):
+        self._push_config_file()
+        self.harness.model.unit.get_container("gnbsim").push(
+            path="/etc/gnbsim/metrics/baselines/release-1.json",
+            source=json.dumps({"success-rate": 1.0, "run-duration": 1000.0, "throughput": 0.0}),
+            make_dirs=True,
+        )
+        patch_check_output.return_value = b"1.2.3.4"
+        patch_exec.return_value.wait_output.return_value = ("", "Profile Status: FAIL")
+
+        with self.assertRaises(testing.ActionFailed) as context:
+            self.harness.run_action("start-simulation", {"baseline": "release-1"})
+
+        self.assertEqual(
+            context.exception.output.results["verdicts"],
+            {"success-rate": "fail", "throughput": "pass", "run-duration": "pass"},
+        )
+
+    @patch("charm.check_output")
+    @patch("ops.model.Container.exec")
+    def test_given_log_level_param_when_start_simulation_then_run_config_uses_log_level_and_logs_are_rotated(  # noqa: E501
+        self, patch_exec, patch_check_output
+    ):
+        self._push_config_file()
+        patch_check_output.return_value = b"1.2.3.4"
+        container = self.harness.model.unit.get_container("gnbsim")
+        run_configs = []
+
+        def read_run_config(command, **kwargs):
+            config_path = command[2].split("--cfg ", 1)[1].split(";", 1)[0]
+            run_configs.append(yaml.safe_load(container.pull(config_path).read()))
+            process = Mock()
+            process.wait_output.return_value = ("", "Profile Status: PASS")
+            return process
+
+        patch_exec.side_effect = read_run_config
+        self.harness.update_config({"log-max-file-size": 2, "log-max-files": 3})
+
+        output = self.harness.run_action("start-simulation", {"log-level": "debug"})
+
+        self.assertEqual(run_configs[0]["logger"]["logLevel"], "debug")
+        script = patch_exec.call_args.kwargs["command"][2]
+        self.assertIn(f"split -b {2 * 1024 * 1024} -a 3", script)
+        self.assertIn("keep=2\n", script)
+        self.assertIn("keep=3\n", script)
+        self.assertEqual(
+            output.results["log-directory"], f"/etc/gnbsim/logs/{output.results['run-id']}"
+        )
+        self.assertEqual(output.results["success"], "true")
+
+    def test_given_log_level_stricter_than_info_when_config_changed_then_status_is_blocked(self):
+        self.harness.update_config({"log-level": "error"})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("`log-level` must be one of: trace, debug, info"),
+        )
+
+    def test_given_negative_simulation_processes_when_config_changed_then_status_is_blocked(self):
+        self.harness.update_config({"simulation-processes": -1})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("`simulation-processes` must be 0 or more"),
+        )
+
+    @patch("ops.model.Container.exec")
+    def test_given_log_level_error_when_start_simulation_then_action_fails_without_running_gnbsim(
+        self, patch_exec
+    ):
+        self._push_config_file()
+        self.harness.update_config({"log-level": "error"})
+
+        with self.assertRaises(testing.ActionFailed) as context:
+            self.harness.run_action("start-simulation")
+
+        self.assertEqual(
+            context.exception.message,
+            "Invalid config: `log-level` must be one of: trace, debug, info",
+        )
+        patch_exec.assert_not_called()
+
+    def test_given_log_max_files_zero_when_config_changed_then_status_is_blocked(self):
+        self.harness.update_config({"log-max-files": 0})
+
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("`log-max-files` must be 1 or more")
+        )
+
+    @patch("ops.model.Container.exec")
+    def test_given_log_max_file_size_zero_when_start_simulation_then_action_fails_without_running_gnbsim(  # noqa: E501
+        self, patch_exec
+    ):
+        self._push_config_file()
+        self.harness.update_config({"log-max-file-size": 0})
+
+        with self.assertRaises(testing.ActionFailed) as context:
+            self.harness.run_action("start-simulation")
+
+        self.assertEqual(
+            context.exception.message, "Invalid config: `log-max-file-size` must be 1 or more"
+        )
+        patch_exec.assert_not_called()
+
+    def test_given_log_files_when_get_log_files_then_log_file_paths_are_returned(self):
+        self.harness.set_can_connect(container="gnbsim", val=True)
+        container = self.harness.model.unit.get_container("gnbsim")
+        for path in (
+            "/etc/gnbsim/logs/3/gnbsim-0.log.aaa.gz",
+            "/etc/gnbsim/logs/3/gnbsim-0.log.aab",
+            "/etc/gnbsim/logs/3/gnbsim-0.status",
+        ):
+            container.push(path=path, source="", make_dirs=True)
+
+        output = self.harness.run_action("get-log-files")
+
+        self.assertEqual(
+            sorted(json.loads(output.results["files"])),
+            ["/etc/gnbsim/logs/3/gnbsim-0.log.aaa.gz", "/etc/gnbsim/logs/3/gnbsim-0.log.aab"],
+        )
+
+    @patch("charm.check_output")
+    @patch("ops.model.Container.exec")
+    def test_given_profiles_on_one_gnb_when_start_simulation_with_two_processes_then_reduction_is_reported(  # noqa: E501
+        self, patch_exec, patch_check_output
+    ):
+        self._push_config_file()
+        patch_check_output.return_value = b"1.2.3.4"
+        patch_exec.return_value.wait_output.return_value = ("", "Profile Status: PASS")
+        self.harness.update_config({"simulation-processes": 2})
+
+        output = self.harness.run_action("start-simulation")
+
+        self.assertEqual(patch_exec.call_count, 1)
+        self.assertEqual(output.results["processes"], "1")
+        self.assertEqual(output.results["requested-processes"], "2")
+        self.assertIn("Ran 1 of 2 requested gnbsim processes", output.results["warning"])
+
+    def test_given_baseline_name_with_path_separator_when_start_simulation_then_action_fails(self):
+        self._push_config_file()
+
+        with self.assertRaises(testing.ActionFailed) as context:
+            self.harness.run_action("start-simulation", {"baseline": "../runs/3"})
+
+        self.assertEqual(
+            context.exception.message, "Baseline name may only contain letters, digits, . _ and -"
+        )
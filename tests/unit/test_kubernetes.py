@@ -0,0 +1,152 @@
+# Copyright 2022 Guillaume Belanger
+# See LICENSE file for licensing details.
+
+import json
+import unittest
+from typing import Optional
+from unittest.mock import patch
+
+from lightkube.models.apps_v1 import StatefulSetSpec
+from lightkube.models.core_v1 import (
+    Container,
+    EmptyDirVolumeSource,
+    PodSpec,
+    PodTemplateSpec,
+    ResourceRequirements,
+    SecurityContext,
+    Volume,
+    VolumeMount,
+)
+from lightkube.models.meta_v1 import LabelSelector, ObjectMeta
+from lightkube.resources.apps_v1 import StatefulSet
+
+from kubernetes import Kubernetes
+
+
+def _statefulset(
+    resources: Optional[ResourceRequirements] = None,
+    hugepages: bool = False,
+    charm_resources: Optional[ResourceRequirements] = None,
+) -> StatefulSet:
+    volumes = [Volume(name="hugepages", emptyDir=EmptyDirVolumeSource(medium="HugePages"))]
+    volume_mounts = [VolumeMount(name="hugepages", mountPath="/dev/hugepages")]
+    return StatefulSet(
+        metadata=ObjectMeta(name="gnbsim"),
+        spec=StatefulSetSpec(
+            selector=LabelSelector(),
+            serviceName="gnbsim",
+            template=PodTemplateSpec(
+                metadata=ObjectMeta(annotations={"k8s.v1.cni.cncf.io/networks": json.dumps([])}),
+                spec=PodSpec(
+                    containers=[
+                        Container(name="charm", resources=charm_resources),
+                        Container(
+                            name="gnbsim",
+                            securityContext=SecurityContext(),
+                            resources=resources,
+                            volumeMounts=volume_mounts if hugepages else None,
+                        ),
+                    ],
+                    initContainers=[Container(name="charm-init", resources=charm_resources)],
+                    volumes=volumes if hugepages else None,
+                ),
+            ),
+        ),
+    )
+
+
+class TestKubernetes(unittest.TestCase):
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, patch_k8s_client):
+        self.kubernetes = Kubernetes(namespace="whatever")
+
+    @patch("lightkube.core.client.Client.get")
+    def test_given_resources_in_canonical_form_when_statefulset_is_patched_then_returns_true(
+        self, patch_get
+    ):
+        canonical = {"cpu": "500m", "memory": "1Gi"}
+        charm_canonical = {"cpu": "250m", "memory": "256Mi"}
+        patch_get.return_value = _statefulset(
+            resources=ResourceRequirements(requests=canonical, limits=canonical),
+            charm_resources=ResourceRequirements(requests=charm_canonical, limits=charm_canonical),
+        )
+        configured = {"cpu": "0.5", "memory": "1024Mi"}
+
+        is_patched = self.kubernetes.statefulset_is_patched(
+            statefulset_name="gnbsim",
+            resource_requirements=ResourceRequirements(requests=configured, limits=configured),
+        )
+
+        self.assertTrue(is_patched)
+
+    @patch("lightkube.core.client.Client.get")
+    def test_given_resources_applied_and_none_expected_when_statefulset_is_patched_then_returns_false(  # noqa: E501
+        self, patch_get
+    ):
+        resources = {"cpu": "2", "memory": "2Gi", "hugepages-2Mi": "512Mi"}
+        patch_get.return_value = _statefulset(
+            resources=ResourceRequirements(requests=resources, limits=resources), hugepages=True
+        )
+
+        is_patched = self.kubernetes.statefulset_is_patched(
+            statefulset_name="gnbsim", resource_requirements=None
+        )
+
+        self.assertFalse(is_patched)
+
+    @patch("lightkube.core.client.Client.patch")
+    @patch("lightkube.core.client.Client.get")
+    def test_given_resources_applied_when_patch_statefulset_without_resources_then_resources_and_hugepages_are_removed(  # noqa: E501
+        self, patch_get, patch_patch
+    ):
+        resources = {"cpu": "2", "memory": "2Gi", "hugepages-2Mi": "512Mi"}
+        charm_resources = {"cpu": "250m", "memory": "256Mi"}
+        patch_get.side_effect = lambda **kwargs: _statefulset(
+            resources=ResourceRequirements(requests=resources, limits=resources),
+            hugepages=True,
+            charm_resources=ResourceRequirements(requests=charm_resources, limits=charm_resources),
+        )
+
+        self.kubernetes.patch_statefulset(statefulset_name="gnbsim", resource_requirements=None)
+
+        pod_spec = patch_patch.call_args.kwargs["obj"].spec.template.spec
+        self.assertIsNone(pod_spec.containers[0].resources)
+        self.assertIsNone(pod_spec.containers[1].resources)
+        self.assertIsNone(pod_spec.initContainers[0].resources)
+        self.assertEqual(pod_spec.volumes, [])
+        self.assertEqual(pod_spec.containers[1].volumeMounts, [])
+
+    @patch("lightkube.core.client.Client.patch")
+    @patch("lightkube.core.client.Client.get")
+    def test_given_resources_when_patch_statefulset_then_all_containers_have_equal_cpu_and_memory_requests_and_limits(  # noqa: E501
+        self, patch_get, patch_patch
+    ):
+        patch_get.side_effect = lambda **kwargs: _statefulset()
+        resources = {"cpu": "2", "memory": "2Gi"}
+
+        self.kubernetes.patch_statefulset(
+            statefulset_name="gnbsim",
+            resource_requirements=ResourceRequirements(requests=resources, limits=resources),
+        )
+
+        pod_spec = patch_patch.call_args.kwargs["obj"].spec.template.spec
+        for container in pod_spec.containers + pod_spec.initContainers:
+            self.assertIn("cpu", container.resources.limits)
+            self.assertIn("memory", container.resources.limits)
+            self.assertEqual(container.resources.requests, container.resources.limits)
+
+    @patch("lightkube.core.client.Client.get")
+    def test_given_charm_containers_without_resources_when_statefulset_is_patched_then_returns_false(  # noqa: E501
+        self, patch_get
+    ):
+        resources = {"cpu": "2", "memory": "2Gi"}
+        patch_get.return_value = _statefulset(
+            resources=ResourceRequirements(requests=resources, limits=resources)
+        )
+
+        is_patched = self.kubernetes.statefulset_is_patched(
+            statefulset_name="gnbsim",
+            resource_requirements=ResourceRequirements(requests=resources, limits=resources),
+        )
+
+        self.assertFalse(is_patched)
@@ -0,0 +1,60 @@
+# Copyright 2022 Guillaume Belanger
+# See LICENSE file for licensing details.
+
+import unittest
+
+from performance import compare, measure
+
+
+class TestPerformance(unittest.TestCase):
+    def test_given_process_outputs_when_measure_then_success_rate_and_throughput_are_computed(
+        self,
+    ):
+        outputs = [
+            "Profile Status: PASS\nProfile Status: FAIL",
+            "Profile Status: PASS\nProfile Status: PASS",
+        ]
+
+        metrics = measure(outputs=outputs, profile_count=4, ue_count=20, run_duration=10.0)
+
+        self.assertEqual(metrics, {"success-rate": 0.75, "run-duration": 10.0, "throughput": 1.5})
+
+    def test_given_failed_process_without_summary_when_measure_then_its_profiles_count_as_failed(
+        self,
+    ):
+        outputs = ["Profile Status: PASS", ""]
+
+        metrics = measure(outputs=outputs, profile_count=2, ue_count=10, run_duration=1.0)
+
+        self.assertEqual(metrics["success-rate"], 0.5)
+        self.assertEqual(metrics["throughput"], 5.0)
+
+    def test_given_no_enabled_profiles_when_measure_then_success_rate_is_zero(self):
+        metrics = measure(outputs=[""], profile_count=0, ue_count=0, run_duration=1.0)
+
+        self.assertEqual(metrics["success-rate"], 0.0)
+        self.assertEqual(metrics["throughput"], 0.0)
+
+    def test_given_metrics_within_tolerance_when_compare_then_all_verdicts_pass(self):
+        baseline = {"success-rate": 1.0, "run-duration": 100.0, "throughput": 2.0}
+        metrics = {"success-rate": 0.95, "run-duration": 109.0, "throughput": 1.85}
+
+        verdicts = compare(
+            baseline=baseline, metrics=metrics, throughput_tolerance=10, latency_tolerance=10
+        )
+
+        self.assertEqual(
+            verdicts, {"success-rate": "pass", "throughput": "pass", "run-duration": "pass"}
+        )
+
+    def test_given_throughput_drop_and_latency_rise_when_compare_then_verdicts_fail(self):
+        baseline = {"success-rate": 1.0, "run-duration": 100.0, "throughput": 2.0}
+        metrics = {"success-rate": 1.0, "run-duration": 111.0, "throughput": 1.7}
+
+        verdicts = compare(
+            baseline=baseline, metrics=metrics, throughput_tolerance=10, latency_tolerance=10
+        )
+
+        self.assertEqual(
+            verdicts, {"success-rate": "pass", "throughput": "fail", "run-duration": "fail"}
+        )
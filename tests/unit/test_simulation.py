@@ -0,0 +1,130 @@
+# Copyright 2022 Guillaume Belanger
+# See LICENSE file for licensing details.
+
+import unittest
+
+import yaml
+
+from simulation import gnbsim_command, simulation_passed, split_config
+
+
+def _profile(name: str, gnb_name: str, start_imsi: int, ue_count: int = 5) -> dict:
+    return {
+        "profileName": name,
+        "gnbName": gnb_name,
+        "enable": True,
+        "startImsi": start_imsi,
+        "ueCount": ue_count,
+    }
+
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.config = {
+            "configuration": {
+                "gnbs": {"gnb1": {"name": "gnb1"}, "gnb2": {"name": "gnb2"}},
+                "httpServer": {"enable": True, "port": 6000},
+                "profiles": [
+                    _profile("profile1", "gnb1", 208930100007487),
+                    _profile("profile2", "gnb2", 208930100007487),
+                    dict(_profile("profile3", "gnb2", 208930100007497), enable=False),
+                ],
+                "customProfiles": {
+                    "customProfiles1": _profile("custom1", "gnb1", 208930100007487, 30),
+                },
+            }
+        }
+
+    def test_given_one_process_when_split_config_then_config_is_returned_unchanged(self):
+        configs = split_config(self.config, processes=1)
+
+        self.assertEqual(configs, [self.config])
+        self.assertIsNot(configs[0], self.config)
+
+    def test_given_more_processes_than_groups_when_split_config_then_one_config_per_group(self):
+        self.config["configuration"]["profiles"][1]["startImsi"] = 208930100007587
+
+        configs = split_config(self.config, processes=8)
+
+        self.assertEqual(len(configs), 2)
+        self.assertEqual(list(configs[0]["configuration"]["gnbs"]), ["gnb1"])
+        self.assertEqual(list(configs[1]["configuration"]["gnbs"]), ["gnb2"])
+        self.assertEqual(
+            [profile["profileName"] for profile in configs[1]["configuration"]["profiles"]],
+            ["profile2"],
+        )
+
+    def test_given_overlapping_imsis_on_different_gnbs_when_split_config_then_profiles_stay_in_one_config(  # noqa: E501
+        self,
+    ):
+        configs = split_config(self.config, processes=2)
+
+        self.assertEqual(configs, [self.config])
+
+    def test_given_several_processes_when_split_config_then_http_server_only_enabled_in_first(
+        self,
+    ):
+        self.config["configuration"]["profiles"][1]["startImsi"] = 208930100007587
+
+        configs = split_config(self.config, processes=2)
+
+        self.assertTrue(configs[0]["configuration"]["httpServer"]["enable"])
+        self.assertFalse(configs[1]["configuration"]["httpServer"]["enable"])
+
+    def test_given_groups_sharing_a_process_when_split_config_then_profiles_keep_their_original_order(  # noqa: E501
+        self,
+    ):
+        self.config["configuration"]["customProfiles"] = {}
+        self.config["configuration"]["profiles"] = [
+            _profile("profile1", "gnb1", 208930100000000),
+            _profile("profile2", "gnb2", 208930100000100),
+            _profile("profile3", "gnb3", 208930100000200),
+            _profile("profile4", "gnb1", 208930100000300),
+        ]
+
+        configs = split_config(self.config, processes=2)
+
+        self.assertEqual(
+            [profile["profileName"] for profile in configs[0]["configuration"]["profiles"]],
+            ["profile1", "profile3", "profile4"],
+        )
+
+    def test_given_profiles_without_start_imsi_when_split_config_then_they_are_grouped_by_gnb(
+        self,
+    ):
+        for profile in self.config["configuration"]["profiles"]:
+            del profile["startImsi"]
+
+        configs = split_config(self.config, processes=2)
+
+        self.assertEqual(len(configs), 2)
+        self.assertEqual(
+            [profile["profileName"] for profile in configs[1]["configuration"]["profiles"]],
+            ["profile2"],
+        )
+
+    def test_given_split_config_then_original_config_is_unchanged(self):
+        original = yaml.safe_dump(self.config)
+
+        split_config(self.config, processes=2)
+
+        self.assertEqual(yaml.safe_dump(self.config), original)
+
+    def test_given_pass_status_in_output_when_simulation_passed_then_returns_true(self):
+        self.assertTrue(simulation_passed("Profile Name: profile2 , Profile Status: PASS"))
+        self.assertFalse(simulation_passed("Profile Name: profile2 , Profile Status: FAIL"))
+
+    def test_given_log_settings_when_gnbsim_command_then_output_is_split_pruned_and_gzipped(self):
+        command = gnbsim_command(
+            config_path="/etc/gnbsim/runs/1/gnb-0.conf",
+            log_prefix="/etc/gnbsim/logs/1/gnbsim-0",
+            max_file_size=1024,
+            max_files=2,
+        )
+
+        self.assertEqual(command[:2], ["sh", "-c"])
+        self.assertIn("/gnbsim/bin/gnbsim --cfg /etc/gnbsim/runs/1/gnb-0.conf", command[2])
+        self.assertIn("split -b 1024 -a 3 - /etc/gnbsim/logs/1/gnbsim-0.log.", command[2])
+        self.assertIn("keep=1\nwhile kill -0 $!", command[2])
+        self.assertIn("keep=2\nrotate", command[2])
+        self.assertIn("cat /etc/gnbsim/logs/1/gnbsim-0.summary >&2", command[2])
@@ -0,0 +1,163 @@
+# Copyright 2022 Guillaume Belanger
+# See LICENSE file for licensing details.
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from lightkube.resources.apps_v1 import StatefulSet
+
+import tracing
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        tracing._spans.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, tracing.SPANS_FILE_NAME)
+
+    def test_given_span_when_flush_then_span_is_written_with_duration_and_hook(self):
+        with tracing.span("k8s.get", resource="StatefulSet") as record:
+            record["response_bytes"] = 12
+
+        tracing.flush(path=self.path, hook="hooks/install")
+
+        with open(self.path, "r") as f:
+            written = [json.loads(line) for line in f]
+        self.assertEqual(len(written), 1)
+        self.assertEqual(written[0]["name"], "k8s.get")
+        self.assertEqual(written[0]["hook"], "hooks/install")
+        self.assertEqual(written[0]["resource"], "StatefulSet")
+        self.assertEqual(written[0]["response_bytes"], 12)
+        self.assertIn("duration_ms", written[0])
+
+    def test_given_failing_call_when_span_then_error_is_recorded(self):
+        with self.assertRaises(RuntimeError):
+            with tracing.span("pebble.exec"):
+                raise RuntimeError()
+
+        self.assertEqual(tracing._spans[0]["error"], "RuntimeError")
+
+    @patch("tracing.MAX_SPANS_FILE_SIZE", 1000)
+    def test_given_spans_file_over_max_size_when_flush_then_oldest_spans_are_dropped(self):
+        for index in range(50):
+            with tracing.span("pebble.push", index=index):
+                pass
+            tracing.flush(path=self.path, hook="hooks/config-changed")
+
+        self.assertLessEqual(os.path.getsize(self.path), 1000)
+        with open(self.path, "r") as f:
+            written = [json.loads(line) for line in f]
+        self.assertEqual(written[-1]["index"], 49)
+
+    def test_given_spans_from_several_hooks_when_slowest_spans_then_recent_hooks_sorted_by_duration(  # noqa: E501
+        self,
+    ):
+        records = [
+            ("hooks/install", "a", "k8s.patch", 500),
+            ("hooks/config-changed", "b", "k8s.get", 10),
+            ("hooks/config-changed", "b", "pebble.push", 30),
+            ("actions/start-simulation", "c", "pebble.exec.wait", 20),
+        ]
+        with open(self.path, "w") as f:
+            for hook, invocation, name, duration in records:
+                record = {
+                    "hook": hook,
+                    "invocation": invocation,
+                    "name": name,
+                    "duration_ms": duration,
+                }
+                f.write(json.dumps(record) + "\n")
+
+        spans = tracing.slowest_spans(path=self.path, hooks=2, limit=2)
+
+        self.assertEqual([span["name"] for span in spans], ["pebble.push", "pebble.exec.wait"])
+
+    def test_given_no_spans_file_when_slowest_spans_then_empty_list_is_returned(self):
+        self.assertEqual(tracing.slowest_spans(path=self.path, hooks=5, limit=10), [])
+
+    def test_given_traced_client_when_request_then_span_is_recorded_with_resource(self):
+        client = Mock()
+        client.get.return_value = None
+
+        tracing.TracedClient(client).get(res=StatefulSet, name="gnbsim", namespace="whatever")
+
+        client.get.assert_called_once_with(res=StatefulSet, name="gnbsim", namespace="whatever")
+        self.assertEqual(tracing._spans[0]["name"], "k8s.get")
+        self.assertEqual(tracing._spans[0]["resource"], "StatefulSet")
+        self.assertEqual(tracing._spans[0]["resource_name"], "gnbsim")
+
+    def test_given_traced_client_when_request_fails_then_span_records_error(self):
+        client = Mock()
+        client.patch.side_effect = RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            tracing.TracedClient(client).patch(res=StatefulSet, name="gnbsim", obj=None)
+
+        self.assertEqual(tracing._spans[0]["error"], "RuntimeError")
+
+    def test_given_traced_container_when_push_and_pull_then_spans_record_payload_sizes(self):
+        container = Mock()
+        container.pull.return_value = io.StringIO("logLevel: info")
+        traced_container = tracing.TracedContainer(container)
+
+        traced_container.push(path="/etc/gnbsim/gnb.conf", source="content")
+        content = traced_container.pull("/etc/gnbsim/gnb.conf").read()
+
+        self.assertEqual(content, "logLevel: info")
+        self.assertEqual(
+            [(span["name"], span["path"]) for span in tracing._spans],
+            [("pebble.push", "/etc/gnbsim/gnb.conf"), ("pebble.pull", "/etc/gnbsim/gnb.conf")],
+        )
+        self.assertEqual(tracing._spans[0]["request_bytes"], 7)
+        self.assertEqual(tracing._spans[1]["response_bytes"], 14)
+
+    def test_given_traced_container_when_can_connect_then_span_is_recorded(self):
+        container = Mock()
+        container.can_connect.return_value = True
+
+        self.assertTrue(tracing.TracedContainer(container).can_connect())
+
+        self.assertEqual(tracing._spans[0]["name"], "pebble.can_connect")
+
+    def test_given_traced_container_when_exec_and_wait_output_then_both_are_recorded(self):
+        container = Mock()
+        container.exec.return_value.wait_output.return_value = ("", "Profile Status: PASS")
+
+        process = tracing.TracedContainer(container).exec(command=["ip", "route"], timeout=30)
+        output = process.wait_output()
+
+        container.exec.assert_called_once_with(command=["ip", "route"], timeout=30)
+        self.assertEqual(output, ("", "Profile Status: PASS"))
+        self.assertEqual(
+            [(span["name"], span["command"]) for span in tracing._spans],
+            [("pebble.exec", "ip route"), ("pebble.exec.wait", "ip route")],
+        )
+        self.assertEqual(tracing._spans[1]["response_bytes"], 20)
+
+    def test_given_replace_fails_when_flush_then_previous_spans_file_is_kept(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"invocation": "a", "duration_ms": 1}) + "\n")
+        with tracing.span("k8s.get"):
+            pass
+
+        with patch("os.replace", side_effect=OSError()):
+            with self.assertRaises(OSError):
+                tracing.flush(path=self.path, hook="hooks/install")
+
+        with open(self.path, "r") as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.assertEqual(os.listdir(self.directory.name), [tracing.SPANS_FILE_NAME])
+
+    def test_given_truncated_line_when_slowest_spans_then_line_is_skipped(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"invocation": "a", "name": "k8s.get", "duration_ms": 5}) + "\n")
+            f.write('{"invocation": "b", "name": "k8s.pa')
+
+        spans = tracing.slowest_spans(path=self.path, hooks=5, limit=10)
+
+        self.assertEqual([span["name"] for span in spans], ["k8s.get"])